@@ -22,28 +22,40 @@ pip install ttkbootstrap pillow qrcode reportlab
 Uso: execute `python gerador_pulseiras.py` e use a interface gráfica.
 """
 
-import io
 import csv
 import math
+import functools
+import hashlib
+import itertools
+import bisect
 import os
 import json
+import logging
 from tkinter import filedialog, messagebox
 import ttkbootstrap as tb
 from ttkbootstrap.constants import *
 from PIL import Image, ImageDraw, ImageFont, ImageTk
 from datetime import datetime
+from collections import Counter, OrderedDict, deque
+from dataclasses import dataclass, field
 import qrcode
 import textwrap
-from reportlab.lib.units import cm
-from reportlab.pdfgen import canvas as pdfcanvas
 import subprocess
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+# Mensagens de depuração: logger.debug não custa nada com o nível padrão (WARNING)
+logger = logging.getLogger(__name__)
 
 # --- Configurações de impressão e conversão cm->px ---
 DPI = 300  # DPI para geração PNG de alta qualidade
+PREVIEW_DPI = DPI // 2  # prévia gerada direto no tamanho do canvas (metade da impressão, ~1/4 dos pixels)
+PNG_COMPRESS_LEVEL = 1  # zlib 1: exportação PNG bem mais rápida, arquivos ~20% maiores (padrão do PIL: 6)
 CM_TO_INCH = 1 / 2.54
 
-def cm_to_px(value_cm):
-    return int(round(value_cm * CM_TO_INCH * DPI))
+def cm_to_px(value_cm, dpi=DPI):
+    return int(round(value_cm * CM_TO_INCH * dpi))
 
 # Dimensões físicas
 PULSEIRA_W_CM = 29.5
@@ -55,6 +67,10 @@ SPACING_CM = 0.5
 # Conversões em pixels
 P_WIDTH = cm_to_px(PULSEIRA_W_CM)
 P_HEIGHT = cm_to_px(PULSEIRA_H_CM)
+# página do PDF em pontos (1/72"): a imagem em DPI ocupa a página inteira
+PDF_PAGE_W_PT = P_WIDTH * 72.0 / DPI
+PDF_PAGE_H_PT = P_HEIGHT * 72.0 / DPI
+PDF_PAGE_SIZE = (PDF_PAGE_W_PT, PDF_PAGE_H_PT)
 NP_START_PX = cm_to_px(NON_PRINTABLE_START_CM)
 PRINTABLE_W_PX = cm_to_px(PRINTABLE_W_CM)
 SPACING_PX = cm_to_px(SPACING_CM)
@@ -84,7 +100,15 @@ EXPECTED_COLUMNS = [
 
 # Funções utilitárias
 
-def generate_qr_image(data, size_px):
+@functools.lru_cache(maxsize=256)
+def _load_font(path, size):
+    """ImageFont.truetype com cache por (path, size): cada arquivo/tamanho é lido uma única vez."""
+    return ImageFont.truetype(path, size=size)
+
+
+@functools.lru_cache(maxsize=1024)
+def _generate_qr_cached(data, size_px):
+    """Codifica o QR uma única vez por (data, size_px); retorna os bytes da imagem 1-bit (modo '1')."""
     qr = qrcode.QRCode(
         version=2,
         error_correction=qrcode.constants.ERROR_CORRECT_M,
@@ -93,102 +117,274 @@ def generate_qr_image(data, size_px):
     )
     qr.add_data(data)
     qr.make(fit=True)
-    img = qr.make_image(fill_color="black", back_color="white").convert('RGB')
-    img = img.resize((size_px, size_px), Image.LANCZOS)
-    return img
+    # matriz de módulos (True = preto) -> um pixel por módulo
+    matrix = qr.get_matrix()
+    n = len(matrix)
+    modules = Image.frombytes('L', (n, n), bytes(0 if cell else 255 for row in matrix for cell in row))
+    # amplia por um fator inteiro (replicação exata, sem filtro) e completa com branco até size_px
+    scale = size_px // n
+    side = n * scale if scale else size_px  # matriz maior que size_px: apenas reduz
+    modules = modules.resize((side, side), Image.NEAREST)
+    img = Image.new('1', (size_px, size_px), 1)
+    offset = (size_px - modules.width) // 2
+    img.paste(modules.convert('1'), (offset, offset))
+    return img.tobytes()
 
 
-def create_pulseira_image(patient_data, logo_image=None, fonts=None):
-    """Gera uma PIL.Image da pulseira a partir dos dados do paciente.
-    fonts pode ser:
-      - (ImageFontRegular, ImageFontBold)  OR
-      - (reg_path, bold_path, base_size_px)  -> nesse caso a função ajusta o tamanho até caber
-    """
-    print(f"[DEBUG] Fonts received: {fonts}")
-    # Cria a imagem base (branco)
-    base = Image.new('RGB', (P_WIDTH, P_HEIGHT), (255, 255, 255))
-    draw = ImageDraw.Draw(base)
+def generate_qr_image(data, size_px):
+    """QR em 1 bit por pixel (modo '1'): ocupa 1/24 do RGB no cache; paste() na base RGB converte."""
+    # bytes imutáveis no cache; cada chamada recebe uma imagem nova (pode ser alterada livremente)
+    return Image.frombytes('1', (size_px, size_px), _generate_qr_cached(data, size_px))
+
+
+@functools.lru_cache(maxsize=8)
+def _logo_max_size(dpi):
+    logo_area_w = cm_to_px(PULSEIRA_W_CM, dpi) - cm_to_px(NON_PRINTABLE_START_CM, dpi) - cm_to_px(PRINTABLE_W_CM, dpi)
+    max_w = int((logo_area_w - cm_to_px(0.2, dpi)) * 1.2)
+    max_h = int((cm_to_px(PULSEIRA_H_CM, dpi) - cm_to_px(0.2, dpi)) * 1.2)
+    return max_w, max_h
+
+
+def fit_logo(logo_image, dpi=DPI):
+    """Reduz o logotipo (LANCZOS) ao tamanho máximo da área não imprimível (~20% maior que a área).
+    Retorna a própria imagem se ela já couber, então pode ser chamada sobre um logo já ajustado."""
+    max_w, max_h = _logo_max_size(dpi)
+    if logo_image.width <= max_w and logo_image.height <= max_h:
+        return logo_image
+    logo = logo_image.copy()
+    logo.thumbnail((max_w, max_h), Image.LANCZOS)
+    return logo
+
+
+def flatten_logo(logo_image):
+    """Descarta o canal alfa de um logo RGBA totalmente opaco (ex.: JPG carregado como RGBA);
+    nas pulseiras basta então um paste RGB direto, sem mistura alfa por paciente.
+    Logos com transparência continuam RGBA: o que fica por baixo (ex.: nome longo) deve aparecer."""
+    if logo_image.mode != 'RGBA' or logo_image.getchannel('A').getextrema() != (255, 255):
+        return logo_image
+    return logo_image.convert('RGB')
+
+
+_scaled_logos = {}  # (id do logo de origem, dpi) -> (logo de origem, logo ajustado)
+
+
+def get_scaled_logo(logo_image, dpi=DPI):
+    """Logo ajustado (fit_logo + flatten_logo) para o dpi de desenho, calculado uma vez por logo/dpi.
+    PIL.Image não é hashable, então a chave é o id; a referência guardada impede que o id seja reutilizado."""
+    key = (id(logo_image), dpi)
+    hit = _scaled_logos.get(key)
+    if hit is not None and hit[0] is logo_image:
+        return hit[1]
+    if len(_scaled_logos) >= 8:
+        _scaled_logos.clear()
+    scaled = flatten_logo(fit_logo(logo_image, dpi))
+    _scaled_logos[key] = (logo_image, scaled)
+    return scaled
+
+
+# Campos: o Nome será tratado separadamente (centralizado)
+FIELDS = [
+    ('Nascimento', 'Data de nascimento'),
+    ('Mãe', 'Nome da mãe'),
+    ('Convênio', 'Convênio'),
+    ('Médico', 'Médico responsável'),
+    ('Sexo', 'Sexo'),
+    ('Admissão', 'Data de admissão'),
+    ('Hora', 'Hora de admissão')
+]
 
-    # Área imprimível
-    printable_left = NP_START_PX
-    printable_top = 0
-    printable_right = printable_left + PRINTABLE_W_PX
-    # Borda da área imprimível (contorno)
-    try:
-        border_width = 3  # px
-        # Ajusta -1 para não estourar os limites da imagem
-        draw.rectangle(
-            [(printable_left, printable_top), (printable_right - 1, P_HEIGHT - 1)],
-            outline=(0, 0, 0), width=border_width
-        )
-    except Exception:
-        pass
 
-    # QR
-    qr_side_px = int(P_HEIGHT - 2 * cm_to_px(0.1))
-    qr_img = generate_qr_image(patient_data.get('Número da carteirinha', ''), qr_side_px)
-    qr_x = printable_left + cm_to_px(0.1)
-    qr_y = int((P_HEIGHT - qr_side_px) / 2)
-    base.paste(qr_img, (qr_x, qr_y))
+def font_line_height(font):
+    bbox = font.getbbox('Hg')
+    return bbox[3] - bbox[1]
+
+
+def wrap_text(text, font, max_width, advance=None):
+    """Quebra o texto em múltiplas linhas para caber em max_width.
+    As larguras vêm da soma acumulada dos avanços de cada caractere (`advance(c)`, por padrão
+    font.getlength); quebras e cortes são achados por busca binária, sem medir linha a linha."""
+    advance = advance or font.getlength
+    words = text.split()
+    if not words:
+        return ['']
+    joined = ' '.join(words)
+    # cum[i] = largura de joined[:i]
+    cum = list(itertools.accumulate((advance(c) for c in joined), initial=0.0))
+    # posições (em joined) de início e fim de cada palavra
+    starts, ends = [], []
+    pos = 0
+    for w in words:
+        starts.append(pos)
+        pos += len(w)
+        ends.append(pos)
+        pos += 1
+    ell_w = advance('.') * 3
+    lines = []
+    i = 0
+    while i < len(words):
+        start = starts[i]
+        # maior índice de caractere que ainda cabe na linha a partir de `start`
+        limit = bisect.bisect_right(cum, cum[start] + max_width) - 1
+        # última palavra que termina dentro do limite (ao menos uma por linha)
+        j = max(bisect.bisect_right(ends, limit, lo=i) - 1, i)
+        end = ends[j]
+        if cum[end] - cum[start] > max_width:
+            # palavra isolada maior que max_width: corta caracteres até caber
+            cut = bisect.bisect_right(cum, cum[start] + max_width - ell_w, lo=start, hi=end + 1) - 1
+            lines.append(joined[start:max(cut, start + 1)] + '...')
+        else:
+            lines.append(joined[start:end])
+        i = j + 1
+    return lines
+
+
+@dataclass
+class RenderContext:
+    """Fontes e geometria resolvidas uma única vez por lote de pulseiras.
+    Com auto-ajuste, font_regular/font_bold ficam None e o tamanho é escolhido por paciente."""
+    font_regular: object
+    font_bold: object
+    name_font_bold: object
+    reg_path: str = None
+    bold_path: str = None
+    base_size: int = 0
+    auto_fit: bool = False
+    # geometria (em px para `dpi`): pulseira, área imprimível e área de texto (à direita do QR)
+    dpi: int = DPI
+    width: int = 0
+    height: int = 0
+    printable_left: int = 0
+    printable_right: int = 0
+    spacing: int = 0
+    border_width: int = 3
+    qr_side_px: int = 0
+    qr_x: int = 0
+    qr_y: int = 0
+    text_x: int = 0
+    text_max_w: int = 0
+    col_gap: int = 0
+    col_w: int = 0
+    top_margin: int = 0
+    bottom_margin: int = 0
+    max_y: int = 0
+    logo_x: int = 0
+    # caches: fonte -> {caractere: avanço}, fonte -> altura de linha, tamanho -> (regular, bold)
+    _advances: dict = field(default_factory=dict, repr=False)
+    _line_heights: dict = field(default_factory=dict, repr=False)
+    _sized_fonts: dict = field(default_factory=dict, repr=False)
+    _blank: object = field(default=None, repr=False)
+
+    def blank_page(self):
+        """Base (branco) com a borda da área imprimível; não alterar, usar .copy()."""
+        if self._blank is None:
+            page = Image.new('RGB', (self.width, self.height), (255, 255, 255))
+            # Borda da área imprimível (contorno)
+            try:
+                # Ajusta -1 para não estourar os limites da imagem
+                ImageDraw.Draw(page).rectangle(
+                    [(self.printable_left, 0), (self.printable_right - 1, self.height - 1)],
+                    outline=(0, 0, 0), width=self.border_width
+                )
+            except Exception:
+                pass
+            self._blank = page
+        return self._blank
+
+    def advance(self, font):
+        """Retorna uma função caractere -> avanço (font.getlength) com cache por fonte."""
+        cache = self._advances.setdefault(font, {})
+
+        def char_advance(c):
+            w = cache.get(c)
+            if w is None:
+                w = cache[c] = font.getlength(c)
+            return w
+        return char_advance
+
+    def line_height(self, font):
+        h = self._line_heights.get(font)
+        if h is None:
+            h = self._line_heights[font] = font_line_height(font)
+        return h
+
+    def fonts_at(self, size):
+        """(regular, bold) no tamanho pedido, carregadas uma vez por lote."""
+        pair = self._sized_fonts.get(size)
+        if pair is None:
+            try:
+                pair = (_load_font(self.reg_path, size),
+                        _load_font(self.bold_path or self.reg_path, size))
+            except Exception:
+                fr = ImageFont.load_default()
+                pair = (fr, fr)
+            self._sized_fonts[size] = pair
+        return pair
+
+
+@functools.lru_cache(maxsize=8)
+def layout_geometry(dpi=DPI):
+    """Geometria da pulseira em px para `dpi` (campos de RenderContext), calculada uma vez por resolução.
+    O dict retornado é compartilhado: não alterar."""
+    # Área imprimível, QR e área de texto
+    scale = dpi / DPI
+    height = cm_to_px(PULSEIRA_H_CM, dpi)
+    spacing = cm_to_px(SPACING_CM, dpi)
+    printable_left = cm_to_px(NON_PRINTABLE_START_CM, dpi)
+    printable_right = printable_left + cm_to_px(PRINTABLE_W_CM, dpi)
+    qr_side_px = int(height - 2 * cm_to_px(0.1, dpi))
+    qr_x = printable_left + cm_to_px(0.1, dpi)
+    text_x = qr_x + qr_side_px + spacing
+    text_max_w = printable_right - text_x - cm_to_px(0.1, dpi)
+    col_gap = cm_to_px(0.1, dpi)
+    return dict(
+        dpi=dpi,
+        width=cm_to_px(PULSEIRA_W_CM, dpi),
+        height=height,
+        printable_left=printable_left,
+        printable_right=printable_right,
+        spacing=spacing,
+        border_width=max(1, round(3 * scale)),
+        qr_side_px=qr_side_px,
+        qr_x=qr_x,
+        qr_y=int((height - qr_side_px) / 2),
+        text_x=text_x,
+        text_max_w=text_max_w,
+        col_gap=col_gap,
+        col_w=int((text_max_w - col_gap) / 2),
+        top_margin=cm_to_px(0.05, dpi),
+        bottom_margin=cm_to_px(0.05, dpi),
+        max_y=height - cm_to_px(0.05, dpi),
+        logo_x=printable_right + cm_to_px(0.05, dpi),
+    )
 
-    # textos
-    text_x = qr_x + qr_side_px + SPACING_PX
-    text_max_w = printable_right - text_x - cm_to_px(0.1)
 
-    print(f"[DEBUG] Text max width: {text_max_w}")
+def build_render_context(fonts=None, dpi=DPI):
+    """Resolve `fonts` (mesmos formatos de create_pulseira_image) em um RenderContext.
+    Com dpi diferente de DPI, a geometria e os tamanhos de fonte (px na resolução de impressão)
+    são escalados na mesma proporção."""
+    logger.debug("Fonts received: %s", fonts)
     # Evita acessar atributo .size em caso de paths (strings)
     try:
         if fonts:
             if isinstance(fonts[0], str):
                 base_sz = fonts[2] if len(fonts) > 2 else 'N/A'
-                print(f"[DEBUG] Fonts info: paths provided, base_size={base_sz}")
+                logger.debug("Fonts info: paths provided, base_size=%s", base_sz)
             else:
                 # Pode não existir atributo size, então apenas informa o tipo
-                print("[DEBUG] Fonts info: ImageFont objects provided")
+                logger.debug("Fonts info: ImageFont objects provided")
         else:
-            print("[DEBUG] Fonts info: using global defaults")
+            logger.debug("Fonts info: using global defaults")
     except Exception as _e:
-        print(f"[DEBUG] Fonts info: error reading fonts -> {_e}")
-
-    # Campos: o Nome será tratado separadamente (centralizado)
-    fields = [
-        ('Nascimento', 'Data de nascimento'),
-        ('Mãe', 'Nome da mãe'),
-        ('Convênio', 'Convênio'),
-        ('Médico', 'Médico responsável'),
-        ('Sexo', 'Sexo'),
-        ('Admissão', 'Data de admissão'),
-        ('Hora', 'Hora de admissão')
-    ]
-
-    def wrap_text(draw_obj, text, font, max_width):
-        """Quebra o texto em múltiplas linhas para caber em max_width usando medições do draw_obj."""
-        words = text.split()
-        if not words:
-            return ['']
-        lines = []
-        cur = words[0]
-        for w in words[1:]:
-            test = cur + ' ' + w
-            bbox = draw_obj.textbbox((0,0), test, font=font)
-            if bbox[2] - bbox[0] <= max_width:
-                cur = test
-            else:
-                lines.append(cur)
-                cur = w
-        lines.append(cur)
-        # caso alguma palavra isolada seja maior que max_width, força corte
-        for i, ln in enumerate(lines):
-            bbox = draw_obj.textbbox((0,0), ln, font=font)
-            if bbox[2] - bbox[0] > max_width:
-                # corta caracteres até caber
-                s = ln
-                while draw_obj.textbbox((0,0), s + '...', font=font)[2] - draw_obj.textbbox((0,0), s + '...', font=font)[0] > max_width and len(s) > 1:
-                    s = s[:-1]
-                lines[i] = s + '...'
-        return lines
-
-    # Seleciona fontes locais. Suporta dois formatos em `fonts`.
+        logger.debug("Fonts info: error reading fonts -> %s", _e)
+
+    geometry = layout_geometry(dpi)
+    logger.debug("Text max width: %s", geometry['text_max_w'])
+    scale = dpi / DPI
+
+    def scaled(size_px):
+        return size_px if dpi == DPI else max(1, int(round(size_px * scale)))
+
+    # Seleciona fontes. Suporta dois formatos em `fonts`.
     if fonts and isinstance(fonts[0], str):
         # caso receive (reg_path, bold_path, base_size)
         reg_path = fonts[0]
@@ -196,125 +392,159 @@ def create_pulseira_image(patient_data, logo_image=None, fonts=None):
         base_size = fonts[2] if len(fonts) > 2 else int(cm_to_px(0.35))
         # Nome do paciente com tamanho independente (se fornecido)
         name_size = fonts[4] if len(fonts) > 4 and isinstance(fonts[4], int) else base_size
+        base_size, name_size = scaled(base_size), scaled(name_size)
         # verifica se foi solicitado NÃO auto-ajustar
         no_auto_fit = len(fonts) > 3 and str(fonts[3]).lower() in ("no", "false", "0", "off", "nofit")
-        # Função auxiliar para testar se cabe em duas colunas.
-        def fits_two_columns(test_font_reg, test_font_bold, test_font_name_bold):
-            # Alturas e larguras disponíveis
-            top_margin = cm_to_px(0.05)
-            bottom_margin = cm_to_px(0.05)
-            # Primeiro desenhamos o nome em bold, centralizado na área de texto
-            name_text = str(patient_data.get('Nome do paciente', '')).strip()
-            name_text = name_text if name_text else ''
-            bbox_name = draw.textbbox((0, 0), name_text, font=test_font_name_bold)
-            name_h = bbox_name[3] - bbox_name[1]
-            # Alturas de linhas adicionais acima das colunas: número + extra + timestamp (estimadas)
-            number_text = str(patient_data.get('Número da carteirinha', '')).strip()
-            number_text = number_text if number_text else ''
-            number_h = test_font_reg.getbbox('Hg')[3] - test_font_reg.getbbox('Hg')[1] if number_text else 0
-            extra_text = patient_data.get('Texto adicional') or patient_data.get('Texto Adicional')
-            extra_text = str(extra_text).strip() if extra_text else ''
-            # texto adicional com fonte aumentada (2.0x da base)
-            extra_factor = 2.0
-            extra_h = int((test_font_reg.getbbox('Hg')[3] - test_font_reg.getbbox('Hg')[1]) * extra_factor) if extra_text else 0
-            ts_text = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-            ts_h = test_font_reg.getbbox('Hg')[3] - test_font_reg.getbbox('Hg')[1]
-
-            # Área disponível para demais campos abaixo do nome
-            avail_h = P_HEIGHT - top_margin - bottom_margin - name_h - SPACING_PX
-            # desconta linhas extras acima das colunas
-            if number_h:
-                avail_h -= (number_h + SPACING_PX)
-            if extra_h:
-                avail_h -= (extra_h + SPACING_PX)
-            # timestamp ficará abaixo das colunas; não descontar aqui
-            if avail_h <= 0:
-                return False
-            # Duas colunas dentro do espaço de texto
-            col_gap = cm_to_px(0.1)
-            col_w = int((text_max_w - col_gap) / 2)
-            if col_w <= 20:
-                return False
-            # Simula o empacotamento
-            line_h = test_font_reg.getbbox('Hg')[3] - test_font_reg.getbbox('Hg')[1]
-            y = 0
-            col = 0
-            for label, key in fields:
-                value = patient_data.get(key, '')
-                text = f"{label}: {value}"
-                lines = wrap_text(draw, text, test_font_reg, col_w)
-                for _ in lines:
-                    if y + line_h > avail_h:
-                        # próxima coluna
-                        col += 1
-                        y = 0
-                        if col >= 2:
-                            return False
-                    y += line_h + SPACING_PX
-            return True
-
-        # Escolhe tamanho: se no_auto_fit for True, usa exatamente base_size;
-        # caso contrário, reduz até caber nas duas colunas.
         # preparar fonte do nome (bold) com tamanho específico
         try:
-            NAME_FONT_BOLD_LOCAL = ImageFont.truetype(bold_path or reg_path, size=name_size)
+            name_font_bold = _load_font(bold_path or reg_path, name_size)
         except Exception:
-            NAME_FONT_BOLD_LOCAL = ImageFont.load_default()
-
+            name_font_bold = ImageFont.load_default()
+        ctx = RenderContext(None, None, name_font_bold, reg_path=reg_path, bold_path=bold_path,
+                            base_size=base_size, auto_fit=not no_auto_fit, **geometry)
         if no_auto_fit:
-            try:
-                FONT_REGULAR_LOCAL = ImageFont.truetype(reg_path, size=base_size)
-                FONT_BOLD_LOCAL = ImageFont.truetype(bold_path or reg_path, size=base_size)
-            except Exception:
-                FONT_REGULAR_LOCAL = ImageFont.load_default()
-                FONT_BOLD_LOCAL = FONT_REGULAR_LOCAL
-            print(f"[DEBUG] Applied font size (no auto-fit exact): {base_size}; name={name_size}")
-            # valida se cabe; se não, não reduz, apenas continuará podendo vazar (com duas colunas)
-        else:
-            size = base_size
-            while size >= 6:
-                try:
-                    fr_try = ImageFont.truetype(reg_path, size=size)
-                    fb_try = ImageFont.truetype(bold_path or reg_path, size=size)
-                    fb_name_try = NAME_FONT_BOLD_LOCAL
-                except Exception:
-                    fr_try = ImageFont.load_default()
-                    fb_try = fr_try
-                    fb_name_try = NAME_FONT_BOLD_LOCAL
-                if fits_two_columns(fr_try, fb_try, fb_name_try):
-                    FONT_REGULAR_LOCAL = fr_try
-                    FONT_BOLD_LOCAL = fb_try
-                    print(f"[DEBUG] Applied font size (auto-fit): {size}; name={name_size}")
-                    break
-                size -= 1
-            else:
-                # fallback
-                FONT_REGULAR_LOCAL = ImageFont.load_default()
-                FONT_BOLD_LOCAL = FONT_REGULAR_LOCAL
-        # garante NAME_FONT_BOLD_LOCAL definido também no ramo no_auto_fit
-        try:
-            _ = NAME_FONT_BOLD_LOCAL
-        except NameError:
-            try:
-                NAME_FONT_BOLD_LOCAL = ImageFont.truetype(bold_path or reg_path, size=name_size)
-            except Exception:
-                NAME_FONT_BOLD_LOCAL = ImageFont.load_default()
+            # usa exatamente base_size; se não couber, apenas continuará podendo vazar (com duas colunas)
+            ctx.font_regular, ctx.font_bold = ctx.fonts_at(base_size)
+            logger.debug("Applied font size (no auto-fit exact): %s; name=%s", base_size, name_size)
+        return ctx
+
+    # já recebeu ImageFont objects ou nada
+    if fonts:
+        font_regular = fonts[0]
+        font_bold = fonts[1] if len(fonts) > 1 else fonts[0]
     else:
-        # já recebeu ImageFont objects ou nada
-        if fonts and not isinstance(fonts[0], str):
-            FONT_REGULAR_LOCAL = fonts[0]
-            FONT_BOLD_LOCAL = fonts[1] if len(fonts) > 1 else fonts[0]
+        font_regular = FONT_REGULAR
+        font_bold = FONT_BOLD
+    if dpi != DPI:
+        try:
+            font_regular = font_regular.font_variant(size=scaled(font_regular.size))
+            font_bold = font_bold.font_variant(size=scaled(font_bold.size))
+        except Exception:
+            pass  # fonte bitmap (sem tamanho ajustável): usa como está
+    # para caso não haja paths, usa a mesma fonte bold para o nome
+    return RenderContext(font_regular, font_bold, font_bold, **geometry)
+
+
+def _fit_fonts(ctx, patient_data, name_h):
+    """Auto-ajuste: maior tamanho (<= base_size) em que os campos cabem nas duas colunas.
+    As métricas são medidas uma vez em base_size e escaladas linearmente com o tamanho;
+    a fonte real só é aberta para confirmar o tamanho estimado."""
+    number_text = str(patient_data.get('Número da carteirinha', '')).strip()
+    extra_text = patient_data.get('Texto adicional') or patient_data.get('Texto Adicional')
+    extra_text = str(extra_text).strip() if extra_text else ''
+    # texto adicional com fonte aumentada (2.0x da base)
+    extra_factor = 2.0
+    field_texts = [f"{label}: {patient_data.get(key, '')}" for label, key in FIELDS]
+
+    def fits_two_columns(line_h, wrap_w, font, advance, one_line_w=None):
+        # Alturas de linhas adicionais acima das colunas: número + extra (estimadas)
+        number_h = line_h if number_text else 0
+        extra_h = int(line_h * extra_factor) if extra_text else 0
+        # Área disponível para demais campos abaixo do nome
+        avail_h = ctx.height - ctx.top_margin - ctx.bottom_margin - name_h - ctx.spacing
+        # desconta linhas extras acima das colunas
+        if number_h:
+            avail_h -= (number_h + ctx.spacing)
+        if extra_h:
+            avail_h -= (extra_h + ctx.spacing)
+        # timestamp ficará abaixo das colunas; não descontar aqui
+        if avail_h <= 0:
+            return False
+        if ctx.col_w <= 20:
+            return False
+        # Simula o empacotamento
+        y = 0
+        col = 0
+        for i, text in enumerate(field_texts):
+            # campo inteiro cabe em uma linha: dispensa o wrap_text
+            if one_line_w is not None and one_line_w[i] <= wrap_w:
+                n_lines = 1
+            else:
+                n_lines = len(wrap_text(text, font, wrap_w, advance))
+            for _ in range(n_lines):
+                if y + line_h > avail_h:
+                    # próxima coluna
+                    col += 1
+                    y = 0
+                    if col >= 2:
+                        return False
+                y += line_h + ctx.spacing
+        return True
+
+    # métricas de referência (base_size); para outro tamanho, larguras e alturas escalam por size/base_size
+    ref_font = ctx.fonts_at(ctx.base_size)[0]
+    ref_line_h = ctx.line_height(ref_font)
+    ref_advance = ctx.advance(ref_font)
+    # largura de cada campo em uma única linha, medida uma vez no tamanho de referência
+    ref_widths = [sum(ref_advance(c) for c in ' '.join(t.split())) for t in field_texts]
+
+    def estimated_fit(size):
+        k = size / ctx.base_size
+        # larguras * k <= col_w  <=>  larguras <= col_w / k
+        return fits_two_columns(ref_line_h * k, ctx.col_w / k, ref_font, ref_advance, ref_widths)
+
+    def real_fit(size):
+        fr = ctx.fonts_at(size)[0]
+        return fits_two_columns(ctx.line_height(fr), ctx.col_w, fr, ctx.advance(fr))
+
+    # maior tamanho estimado que cabe: caber é monotônico no tamanho, então basta uma busca binária
+    lo, hi = min(6, ctx.base_size), ctx.base_size
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimated_fit(mid):
+            lo = mid
         else:
-            FONT_REGULAR_LOCAL = FONT_REGULAR
-            FONT_BOLD_LOCAL = FONT_BOLD
-        # para caso não haja paths, usa a mesma fonte bold para o nome
-        NAME_FONT_BOLD_LOCAL = FONT_BOLD_LOCAL
+            hi = mid - 1
+    size = lo
+    # confirma com a fonte real (o hinting não escala de forma exatamente linear)
+    while size >= 6 and not real_fit(size):
+        size -= 1
+    if size >= 6:
+        while size < ctx.base_size and real_fit(size + 1):
+            size += 1
+        logger.debug("Applied font size (auto-fit): %s", size)
+        return ctx.fonts_at(size)
+    # fallback
+    fr = ImageFont.load_default()
+    return fr, fr
+
+
+def create_pulseira_image(patient_data, logo_image=None, fonts=None, ctx=None, dpi=DPI):
+    """Gera uma PIL.Image da pulseira a partir dos dados do paciente.
+    fonts pode ser:
+      - (ImageFontRegular, ImageFontBold)  OR
+      - (reg_path, bold_path, base_size_px)  -> nesse caso a função ajusta o tamanho até caber
+    ctx: RenderContext já resolvido (build_render_context) para reaproveitar entre pacientes;
+    quando informado, `fonts` e `dpi` são ignorados.
+    dpi: resolução da imagem gerada (ex.: PREVIEW_DPI para a prévia).
+    """
+    if ctx is None:
+        ctx = build_render_context(fonts, dpi)
+    base, ts_font = render_pulseira_body(patient_data, logo_image, ctx)
+    draw_timestamp(base, ctx, ts_font)
+    return base
+
+
+def render_pulseira_body(patient_data, logo_image, ctx):
+    """Pulseira completa, exceto o timestamp: só depende dos dados, das fontes e do logo,
+    então pode ser reaproveitada entre exportações. Retorna (imagem, fonte do timestamp)."""
+    height = ctx.height
+    spacing = ctx.spacing
+    # Imagem base: cópia (memcpy) da página em branco com a borda, montada uma vez por contexto
+    # (sem pool de imagens: reaproveitar um buffer exigiria o mesmo paste da base e só pouparia a alocação)
+    base = ctx.blank_page().copy()
+    draw = ImageDraw.Draw(base)
+
+    # QR
+    qr_img = generate_qr_image(patient_data.get('Número da carteirinha', ''), ctx.qr_side_px)
+    base.paste(qr_img, (ctx.qr_x, ctx.qr_y))
+
+    # textos
+    text_x = ctx.text_x
+    text_max_w = ctx.text_max_w
+    NAME_FONT_BOLD_LOCAL = ctx.name_font_bold
 
     # Desenho final: nome centralizado e demais campos em duas colunas
-    top_margin = cm_to_px(0.05)
-    bottom_margin = cm_to_px(0.05)
-    col_gap = cm_to_px(0.1)
-    col_w = int((text_max_w - col_gap) / 2)
     # Nome (bold) centralizado horizontalmente na área de texto (à direita do QR)
     # Equivalente a uma 'classe CSS' .paciente-nome: estilização independente do restante dos textos
     name_text = str(patient_data.get('Nome do paciente', '')).strip()
@@ -322,8 +552,16 @@ def create_pulseira_image(patient_data, logo_image=None, fonts=None):
     name_bbox = draw.textbbox((0, 0), name_text, font=NAME_FONT_BOLD_LOCAL)
     name_w = name_bbox[2] - name_bbox[0]
     name_h = name_bbox[3] - name_bbox[1]
+
+    # Escolhe tamanho: sem auto-ajuste usa as fontes do contexto;
+    # caso contrário, reduz até caber nas duas colunas.
+    if ctx.auto_fit:
+        FONT_REGULAR_LOCAL, FONT_BOLD_LOCAL = _fit_fonts(ctx, patient_data, name_h)
+    else:
+        FONT_REGULAR_LOCAL, FONT_BOLD_LOCAL = ctx.font_regular, ctx.font_bold
+
     name_x = text_x + max(0, int((text_max_w - name_w) / 2))
-    name_y = top_margin
+    name_y = ctx.top_margin
     draw.text((name_x, name_y), name_text, font=NAME_FONT_BOLD_LOCAL, fill=(0, 0, 0))
 
     # Número da carteirinha (texto) abaixo do nome, destacado
@@ -335,7 +573,7 @@ def create_pulseira_image(patient_data, logo_image=None, fonts=None):
         number_w = nb[2] - nb[0]
         number_h = nb[3] - nb[1]
         num_x = text_x + max(0, int((text_max_w - number_w) / 2))
-        num_y = name_y + name_h + SPACING_PX
+        num_y = name_y + name_h + spacing
         draw.text((num_x, num_y), card_label, font=FONT_BOLD_LOCAL, fill=(0, 0, 0))
     else:
         num_y = name_y + name_h
@@ -346,13 +584,13 @@ def create_pulseira_image(patient_data, logo_image=None, fonts=None):
     extra_text = str(extra_text).strip() if extra_text else ''
     extra_factor = 2.0
     extra_h = 0
-    y_cursor = (num_y + number_h + SPACING_PX) if card_label else (name_y + name_h + SPACING_PX)
+    y_cursor = (num_y + number_h + spacing) if card_label else (name_y + name_h + spacing)
     if extra_text:
         try:
             # criar fonte maior baseada na regular
             if isinstance(FONT_REGULAR_LOCAL, ImageFont.FreeTypeFont):
                 size_reg = FONT_REGULAR_LOCAL.size
-                extra_font = ImageFont.truetype(FONT_REGULAR_LOCAL.path, size=int(size_reg * extra_factor))
+                extra_font = _load_font(FONT_REGULAR_LOCAL.path, int(size_reg * extra_factor))
             else:
                 extra_font = FONT_BOLD_LOCAL
         except Exception:
@@ -363,61 +601,293 @@ def create_pulseira_image(patient_data, logo_image=None, fonts=None):
         ex = text_x + max(0, int((text_max_w - extra_w) / 2))
         ey = y_cursor
         draw.text((ex, ey), extra_text, font=extra_font, fill=(0, 0, 0))
-        y_cursor = ey + extra_h + SPACING_PX
+        y_cursor = ey + extra_h + spacing
 
     # Área para listas abaixo do nome/numero/extra
+    col_w = ctx.col_w
     y_start = y_cursor
     y = y_start
-    line_height = FONT_REGULAR_LOCAL.getbbox('Hg')[3] - FONT_REGULAR_LOCAL.getbbox('Hg')[1]
+    line_height = ctx.line_height(FONT_REGULAR_LOCAL)
+    advance = ctx.advance(FONT_REGULAR_LOCAL)
     x_col = text_x  # primeira coluna
-    max_y = P_HEIGHT - bottom_margin
+    max_y = ctx.max_y
     overflowed = False
-    for label, key in fields:
+    # cada coluna é desenhada com um único multiline_text; o PIL avança getbbox('A')[3] + spacing
+    # por linha, então o spacing é ajustado para manter o passo line_height + spacing
+    col_spacing = line_height + spacing - FONT_REGULAR_LOCAL.getbbox('A')[3]
+    col_lines = []
+
+    def draw_column(x):
+        if col_lines:
+            draw.multiline_text((x, y_start), '\n'.join(col_lines), font=FONT_REGULAR_LOCAL,
+                                spacing=col_spacing, fill=(0, 0, 0))
+
+    for label, key in FIELDS:
         value = patient_data.get(key, '')
         text = f"{label}: {value}"
-        lines = wrap_text(draw, text, FONT_REGULAR_LOCAL, col_w)
+        lines = wrap_text(text, FONT_REGULAR_LOCAL, col_w, advance)
         for ln in lines:
             if y + line_height > max_y:
                 # vai para a segunda coluna
                 if x_col == text_x:
-                    x_col = text_x + col_w + col_gap
+                    draw_column(x_col)
+                    col_lines = []
+                    x_col = text_x + col_w + ctx.col_gap
                     y = y_start
                 else:
                     overflowed = True
                     break
-            draw.text((x_col, y), ln, font=FONT_REGULAR_LOCAL, fill=(0, 0, 0))
-            y += line_height + SPACING_PX
+            col_lines.append(ln)
+            y += line_height + spacing
         if overflowed:
             break
+    draw_column(x_col)
 
     # logotipo (não imprimível) — aumentar ~20% e alinhar mais à esquerda
-    logo_area_left = printable_left + PRINTABLE_W_PX
-    logo_area_right = P_WIDTH
-    logo_area_w = logo_area_right - logo_area_left
-    logo_area_h = P_HEIGHT
-
     if logo_image:
-        max_w = int((logo_area_w - cm_to_px(0.2)) * 1.2)
-        max_h = int((logo_area_h - cm_to_px(0.2)) * 1.2)
-        logo = logo_image.copy()
-        logo.thumbnail((max_w, max_h), Image.LANCZOS)
+        # já reduzido em upload_logo; aqui só redimensiona se receber o original (ou em outro dpi)
+        logo = fit_logo(logo_image, ctx.dpi)
         # alinhar à esquerda, com pequena margem
-        lx = logo_area_left + cm_to_px(0.05)
-        ly = int((logo_area_h - logo.height)/2)
+        lx = ctx.logo_x
+        ly = int((height - logo.height)/2)
         base.paste(logo, (lx, ly), logo if logo.mode=='RGBA' else None)
 
-    # Timestamp (data/hora da geração) abaixo das colunas, alinhado à direita da área de texto
+    return base, FONT_REGULAR_LOCAL
+
+
+def draw_timestamp(img, ctx, font):
+    """Timestamp (data/hora da geração) abaixo das colunas, alinhado à direita da área de texto.
+    Retorna (posição, recorte do que havia embaixo), para trocar o timestamp numa cópia da página."""
+    draw = ImageDraw.Draw(img)
     ts = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
-    ts_bbox = draw.textbbox((0, 0), ts, font=FONT_REGULAR_LOCAL)
+    ts_bbox = draw.textbbox((0, 0), ts, font=font)
     ts_w = ts_bbox[2] - ts_bbox[0]
     ts_h = ts_bbox[3] - ts_bbox[1]
-    ts_x = text_x + text_max_w - ts_w
-    ts_y = P_HEIGHT - bottom_margin - ts_h
-    draw.text((ts_x, ts_y), ts, font=FONT_REGULAR_LOCAL, fill=(0, 0, 0))
+    ts_x = ctx.text_x + ctx.text_max_w - ts_w
+    ts_y = ctx.height - ctx.bottom_margin - ts_h
+    box = (max(0, ts_x + ts_bbox[0]), max(0, ts_y + ts_bbox[1]),
+           min(img.width, ts_x + ts_bbox[2]), min(img.height, ts_y + ts_bbox[3]))
+    under = img.crop(box)
+    draw.text((ts_x, ts_y), ts, font=font, fill=(0, 0, 0))
+    return box[:2], under
 
-    return base
+# --- Renderização em lote (vários processos) ---
+# Pulseiras mínimas por lote para usar o pool, por método de início dos processos. Medido: cada
+# processo leva ~0,04 s para subir com fork e ~0,3 s com forkserver/spawn (reimporta o app), e uma
+# pulseira leva ~12,5 ms em série; com 2 processos o pool só empata acima de ~2 × início / 12,5 ms
+PARALLEL_MIN_PATIENTS = {'fork': 8, 'forkserver': 48, 'spawn': 56}
+PARALLEL_CHUNK_MAX = 4  # pulseiras por bloco do pool; limita as páginas prontas esperando na fila
+PAGE_CACHE_MAX_BYTES = 32 * 1024 * 1024  # pixels guardados entre exportações: ~13 pulseiras de ~2,5 MB em 300 DPI
+_worker_state = {}
+_page_cache = OrderedDict()  # chave do conteúdo -> (pulseira, fonte, posição e recorte sob o timestamp)
 
-def list_system_fonts():
+
+def make_renderer(logo_image=None, fonts=None, dpi=DPI, ctx=None):
+    """Especializa a renderização para um lote: fontes, geometria e logo são resolvidos aqui,
+    uma única vez, e a função retornada recebe apenas os dados do paciente.
+    Ela devolve (pulseira sem timestamp, fonte do timestamp), como render_pulseira_body."""
+    if ctx is None:
+        ctx = build_render_context(fonts, dpi)
+    logo = get_scaled_logo(logo_image, dpi) if logo_image else None
+
+    def render(patient_data):
+        return render_pulseira_body(patient_data, logo, ctx)
+    return render
+
+
+def _init_render_worker(logo_image, fonts):
+    """Inicializa cada processo do pool com seu próprio renderer do lote."""
+    _worker_state['render'] = make_renderer(logo_image, fonts)
+
+
+def _render_one(patient_data):
+    body, font = _worker_state['render'](patient_data)
+    # a fonte padrão do PIL não é piclável: volta só o tamanho (None = fonte padrão)
+    return body, (font.size if isinstance(getattr(font, 'path', None), str) else None)
+
+
+def _render_chunk(patients):
+    return [_render_one(p) for p in patients]
+
+
+def _usable_cpus():
+    """Núcleos que este processo pode usar: os.cpu_count() conta os da máquina, mesmo com a
+    afinidade (taskset, contêiner) restrita a menos."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except (AttributeError, OSError):
+        return os.cpu_count() or 1
+
+
+def _parallel_min_patients():
+    return PARALLEL_MIN_PATIENTS.get(multiprocessing.get_start_method(), max(PARALLEL_MIN_PATIENTS.values()))
+
+
+def _render_bodies(patients, logo_image, fonts, ctx):
+    """Gera os corpos das pulseiras um a um, na ordem de `patients` (sem acumular o lote).
+    Com fontes por caminho (picláveis) e lotes grandes, distribui entre os núcleos da CPU, com no
+    máximo um bloco em andamento por processo; caso contrário (ImageFont já carregadas, poucos
+    pacientes ou falha no pool), renderiza em série a partir de onde parou."""
+    workers = min(_usable_cpus(), len(patients))
+    done = 0
+    if fonts and isinstance(fonts[0], str) and len(patients) >= _parallel_min_patients() and workers > 1:
+        chunksize = max(1, min(PARALLEL_CHUNK_MAX, len(patients) // (workers * 4)))
+        chunks = (patients[i:i + chunksize] for i in range(0, len(patients), chunksize))
+        try:
+            with ProcessPoolExecutor(max_workers=workers, initializer=_init_render_worker,
+                                     initargs=(logo_image, fonts)) as ex:
+                pending = deque(ex.submit(_render_chunk, c) for c in itertools.islice(chunks, workers))
+                try:
+                    while pending:
+                        results = pending.popleft().result()
+                        nxt = next(chunks, None)
+                        if nxt is not None:
+                            pending.append(ex.submit(_render_chunk, nxt))
+                        while results:
+                            body, size = results.pop(0)
+                            done += 1
+                            yield body, (ctx.fonts_at(size)[0] if size else ImageFont.load_default())
+                            del body
+                finally:
+                    for f in pending:
+                        f.cancel()
+            return
+        except Exception as e:
+            logger.debug("Parallel render failed, falling back to serial: %s", e)
+    render = make_renderer(logo_image, fonts, ctx=ctx)
+    for p in patients[done:]:
+        yield render(p)
+
+
+def _page_key(patient_data, fonts, logo_key):
+    return hashlib.blake2b(repr((sorted(patient_data.items()), fonts, logo_key)).encode('utf-8'),
+                           digest_size=16).digest()
+
+
+def _page_nbytes(entry):
+    page, _, _, under = entry
+    return sum(len(im.getbands()) * im.width * im.height for im in (page, under))
+
+
+def _page_cache_put(key, entry):
+    """Guarda a pulseira em _page_cache e descarta as mais antigas até caber em PAGE_CACHE_MAX_BYTES
+    (a recém-guardada sempre fica)."""
+    _page_cache[key] = entry
+    while len(_page_cache) > 1 and sum(_page_nbytes(e) for e in _page_cache.values()) > PAGE_CACHE_MAX_BYTES:
+        _page_cache.popitem(last=False)
+
+
+def render_pulseiras(patients, logo_image=None, fonts=None):
+    """Gera (generator) as imagens de todos os pacientes, na ordem de `patients`, à medida que ficam prontas.
+    Pulseiras com o mesmo conteúdo (dados, fontes e logo) já geradas nesta sessão saem de _page_cache;
+    só o timestamp é desenhado de novo. Fontes passadas como ImageFont não têm chave estável: sem cache.
+    As imagens entregues podem estar no cache: quem as recebe não deve alterá-las."""
+    patients = list(patients)
+    ctx = build_render_context(fonts)
+    logo = get_scaled_logo(logo_image) if logo_image else None
+    cacheable = not fonts or isinstance(fonts[0], str)
+    if cacheable:
+        logo_key = (logo.mode, logo.size, hashlib.blake2b(logo.tobytes(), digest_size=16).digest()) if logo else None
+        keys = [_page_key(p, fonts, logo_key) for p in patients]
+    else:
+        keys = list(range(len(patients)))
+    remaining = Counter(keys)
+    # acertos do cache ficam presos ao lote: o cache pode descartá-los antes da vez deles
+    held = {}
+    for k in remaining:
+        if k in _page_cache:
+            _page_cache.move_to_end(k)
+            held[k] = _page_cache[k]
+    # linhas repetidas no mesmo lote também são renderizadas uma vez só
+    to_render, seen = [], set(held)
+    for k, p in zip(keys, patients):
+        if k not in seen:
+            seen.add(k)
+            to_render.append(p)
+    rendered = _render_bodies(to_render, logo, fonts, ctx)
+    for k in keys:
+        remaining[k] -= 1
+        entry = held.pop(k, None) if not remaining[k] else held.get(k)
+        if entry is None:
+            # página nova: só ela usa este corpo, o timestamp vai direto nela (sem cópia)
+            page, ts_font = next(rendered)
+            ts_pos, under = draw_timestamp(page, ctx, ts_font)
+            entry = (page, ts_font, ts_pos, under)
+            if cacheable:
+                _page_cache_put(k, entry)
+            if remaining[k]:
+                held[k] = entry
+        else:
+            # página compartilhada (cache ou repetida no lote): cópia, com o timestamp anterior apagado
+            img, ts_font, ts_pos, under = entry
+            page = img.copy()
+            page.paste(under, ts_pos)
+            draw_timestamp(page, ctx, ts_font)
+        yield page
+        # solta as referências antes de renderizar a próxima: quem consome pode liberar a página já gravada
+        page = entry = img = None
+
+
+def save_png(img, path):
+    """Salva a pulseira em PNG RGB (sem canal alfa), com o DPI de impressão nos metadados.
+    zlib nível PNG_COMPRESS_LEVEL e sem optimize: a busca extra de compressão não compensa aqui."""
+    if img.mode != 'RGB':
+        img = img.convert('RGB')
+    img.save(path, format='PNG', dpi=(DPI, DPI), compress_level=PNG_COMPRESS_LEVEL, optimize=False)
+
+
+def write_json_atomic(path, data):
+    """Grava `data` em JSON num arquivo temporário (nome único, na mesma pasta), força os dados ao disco
+    e só então o move sobre `path` (os.replace é atômico): nem uma falha no meio da escrita nem uma queda
+    de energia deixam o destino truncado, e duas instâncias do app não disputam o mesmo temporário.
+    O arquivo final mantém as permissões do anterior (ou as do umask, se ainda não existia)."""
+    payload = json.dumps(data, ensure_ascii=False).encode('utf-8')
+    try:
+        mode = os.stat(path).st_mode & 0o7777
+    except OSError:
+        umask = os.umask(0)
+        os.umask(umask)
+        mode = 0o666 & ~umask
+    tmp = tempfile.NamedTemporaryFile('wb', dir=os.path.dirname(path) or '.',
+                                      prefix=os.path.basename(path) + '.', suffix='.tmp', delete=False)
+    try:
+        # o NamedTemporaryFile nasce 0600 e o os.replace levaria isso para o destino
+        os.chmod(tmp.name, mode)
+        with tmp as f:
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp.name, path)
+    except Exception:
+        try:
+            os.remove(tmp.name)
+        except OSError:
+            pass
+        raise
+
+
+FONTS_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.unipulso_fonts_cache.json')
+FONT_DIRS = ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.local/share/fonts'),
+             os.path.expanduser('~/Library/Fonts'), '/Library/Fonts', 'C:\\\\Windows\\\\Fonts']
+
+
+def _font_dirs_stamp():
+    """mtime das pastas de fontes (e subpastas diretas); muda quando fontes são instaladas/removidas."""
+    stamp = {}
+    for root in FONT_DIRS:
+        if not os.path.isdir(root):
+            continue
+        try:
+            stamp[root] = os.path.getmtime(root)
+            for entry in os.scandir(root):
+                if entry.is_dir():
+                    stamp[entry.path] = entry.stat().st_mtime
+        except OSError:
+            pass
+    return stamp
+
+
+def _scan_system_fonts():
     """Retorna dict: família -> list of (filepath, style)."""
     fonts = {}
     try:
@@ -436,8 +906,7 @@ def list_system_fonts():
                     fonts.setdefault(fam, []).append((path, style))
     except Exception:
         # fallback: procura arquivos .ttf/.otf em pastas comuns
-        for root in ['/usr/share/fonts', '/usr/local/share/fonts', os.path.expanduser('~/.local/share/fonts'),
-                     os.path.expanduser('~/Library/Fonts'), '/Library/Fonts', 'C:\\\\Windows\\\\Fonts']:
+        for root in FONT_DIRS:
             if not os.path.isdir(root):
                 continue
             for dirpath, _, files in os.walk(root):
@@ -449,6 +918,27 @@ def list_system_fonts():
     return fonts
 
 
+def list_system_fonts():
+    """Retorna dict: família -> list of (filepath, style).
+    O resultado fica em FONTS_CACHE_FILE e só é refeito (fc-list/varredura) quando as pastas de fontes mudam."""
+    stamp = _font_dirs_stamp()
+    try:
+        if os.path.isfile(FONTS_CACHE_FILE):
+            with open(FONTS_CACHE_FILE, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data.get('stamp') == stamp and data.get('fonts'):
+                return {fam: [tuple(e) for e in entries] for fam, entries in data['fonts'].items()}
+    except Exception:
+        pass
+    fonts = _scan_system_fonts()
+    if fonts:
+        try:
+            write_json_atomic(FONTS_CACHE_FILE, {'stamp': stamp, 'fonts': fonts})
+        except Exception:
+            pass
+    return fonts
+
+
 def choose_font_file_for_family(fonts_map, family, bold=False, italic=False):
     """Tenta escolher um arquivo de fonte para a família com base em estilo solicitado."""
     entries = fonts_map.get(family, [])
@@ -476,6 +966,9 @@ class PulseiraApp:
         self.root = root
         self.root.title('Gerador de Pulseiras Hospitalares')
         self.logo_image = None
+        self.logo_resized = None  # logo já no tamanho de desenho (preparado uma vez por upload)
+        self.logo_preview = None  # idem, na resolução da prévia
+        self._preview_after_id = None  # prévia agendada pelo diálogo de fonte (debounce)
         self.patients = []
         self.prefs_file = os.path.join(os.path.expanduser('~'), '.unipulso_prefs.json')
 
@@ -509,7 +1002,9 @@ class PulseiraApp:
         preview_frame = tb.LabelFrame(self.main_frame, text='Pré-visualização (Primeira pulseira)')
         preview_frame.pack(fill=BOTH, expand=YES, pady=8)
 
-        self.canvas_preview = tb.Canvas(preview_frame, width=int(P_WIDTH/2), height=int(P_HEIGHT/2), background='white')
+        # canvas no tamanho exato da pulseira em PREVIEW_DPI: a prévia é exibida 1:1, sem redimensionar
+        preview_geo = layout_geometry(PREVIEW_DPI)
+        self.canvas_preview = tb.Canvas(preview_frame, width=preview_geo['width'], height=preview_geo['height'], background='white')
         self.canvas_preview.pack(padx=6, pady=6)
 
         # Label status
@@ -518,6 +1013,7 @@ class PulseiraApp:
         self.status.pack(fill=X, pady=4)
 
         self.fonts_map = list_system_fonts()
+        self._font_path_cache = {}  # (família, bold, italic) -> arquivo escolhido em fonts_map
         families = sorted(self.fonts_map.keys())
         # configurações padrão de fonte (tamanho em pixels)
         default_size = int(cm_to_px(0.35) * 1.5)  # ~50% maior por padrão
@@ -549,6 +1045,9 @@ class PulseiraApp:
         try:
             img = Image.open(path).convert('RGBA')
             self.logo_image = img
+            self.logo_resized = get_scaled_logo(img)
+            # a prévia parte do logo já ajustado, como antes, mas sem reamostrar a cada atualização
+            self.logo_preview = get_scaled_logo(self.logo_resized, PREVIEW_DPI)
             self.status_var.set(f'Logotipo carregado: {os.path.basename(path)}')
             self.update_preview()
         except IOError:
@@ -612,11 +1111,17 @@ class PulseiraApp:
             return
         try:
             with open(path, newline='', encoding='utf-8') as f:
-                reader = csv.DictReader(f)
-                headers = reader.fieldnames
+                reader = csv.reader(f)
+                headers = next(reader, None)
                 if not headers or any(col not in headers for col in EXPECTED_COLUMNS):
                     raise ValueError('CSV não contém todas as colunas esperadas.')
-                self.patients = [row for row in reader]
+                # parser em C do módulo csv + zip por linha (sem a camada Python do DictReader);
+                # linhas em branco são ignoradas; em linha curta o campo que falta sai vazio (não 'None')
+                # e colunas além do cabeçalho são descartadas
+                self.patients = [dict(zip(headers, row)) for row in reader if row]
+            # novo conjunto de dados: descarta QRs e pulseiras do CSV anterior
+            _generate_qr_cached.cache_clear()
+            _page_cache.clear()
             self.status_var.set(f'CSV importado: {os.path.basename(path)} - {len(self.patients)} registros')
             self.update_preview()
         except ValueError as ve:
@@ -624,29 +1129,33 @@ class PulseiraApp:
         except Exception as e:
             messagebox.showerror('Erro', f'Falha ao importar CSV: {e}')
 
-    def update_preview(self):
-        self.canvas_preview.delete('all')
-        if not self.patients:
-            self.canvas_preview.create_text(int(self.canvas_preview['width'])//2, int(self.canvas_preview['height'])//2, text='Sem dados. Importe um CSV.', anchor='center')
-            return
-        patient = self.patients[0]
-        # Passa caminhos + tamanho para enable auto-ajuste vertical
+    def _fonts_arg(self):
+        """Argumento `fonts` do lote: caminhos + tamanho (habilita o auto-ajuste) ou as ImageFont carregadas."""
         if self.font_reg_path:
             # Quarto argumento: 'auto' habilita auto-fit; 'no' usa tamanho exato
-            fonts_arg = (
+            return (
                 self.font_reg_path,
                 self.font_bold_path,
                 self.font_size,
                 'auto' if self.auto_fit_enabled else 'no',
                 self.name_font_size,
             )
-        else:
-            fonts_arg = (self.font_regular, self.font_bold)
-        img = create_pulseira_image(patient, logo_image=self.logo_image, fonts=fonts_arg)
+        return (self.font_regular, self.font_bold)
+
+    def update_preview(self):
+        self.canvas_preview.delete('all')
+        if not self.patients:
+            self.canvas_preview.create_text(int(self.canvas_preview['width'])//2, int(self.canvas_preview['height'])//2, text='Sem dados. Importe um CSV.', anchor='center')
+            return
+        patient = self.patients[0]
+        fonts_arg = self._fonts_arg()
+        # gera direto na resolução da prévia (sem renderizar em 300 DPI e reduzir depois)
+        img = create_pulseira_image(patient, logo_image=self.logo_preview, fonts=fonts_arg, dpi=PREVIEW_DPI)
         cw = int(self.canvas_preview['width'])
         ch = int(self.canvas_preview['height'])
-        img_thumb = img.resize((cw, ch), Image.LANCZOS)
-        self.tkimg = ImageTk.PhotoImage(img_thumb)
+        if img.size != (cw, ch):
+            img = img.resize((cw, ch), Image.LANCZOS)
+        self.tkimg = ImageTk.PhotoImage(img)
         self.canvas_preview.create_image(0,0, image=self.tkimg, anchor='nw')
 
     def export_png(self):
@@ -658,34 +1167,28 @@ class PulseiraApp:
             return
         # Pergunta se quer um arquivo por pulseira ou único
         choice = messagebox.askquestion('Formato PNG', 'Deseja salvar cada pulseira como arquivo separado? (Sim = separado, Não = único arquivo grande)')
-        images = []
-        for i, p in enumerate(self.patients):
-            if self.font_reg_path:
-                fonts_arg = (
-                    self.font_reg_path,
-                    self.font_bold_path,
-                    self.font_size,
-                    'auto' if self.auto_fit_enabled else 'no',
-                    self.name_font_size,
-                )
-            else:
-                fonts_arg = (self.font_regular, self.font_bold)
-            img = create_pulseira_image(p, logo_image=self.logo_image, fonts=fonts_arg)
-            images.append((p, img))
-            if choice == 'yes':
-                fname = os.path.join(save_dir, f"pulseira_{i+1}_{p.get('Número da carteirinha','')}.png")
-                img.save(fname, dpi=(DPI,DPI))
+        fonts_arg = self._fonts_arg()
+        # as pulseiras chegam uma a uma (render_pulseiras é um generator) e são gravadas na hora
+        rendered = render_pulseiras(self.patients, logo_image=self.logo_resized, fonts=fonts_arg)
+        if choice == 'yes':
+            prefix = os.path.join(save_dir, 'pulseira_')
+            for i, (p, img) in enumerate(zip(self.patients, rendered)):
+                fname = f"{prefix}{i+1}_{p.get('Número da carteirinha','')}.png"
+                save_png(img, fname)
+                del img  # gravada: pode ser liberada antes da próxima ser renderizada
         if choice == 'no':
             # junta verticalmente (ou horizontalmente) — faremos vertical stack
-            total_h = sum(img.height for _,img in images)
-            w = images[0][1].width
-            big = Image.new('RGB', (w, total_h), (255,255,255))
+            big = None
             y = 0
-            for _,img in images:
+            for img in rendered:
+                if big is None:
+                    # todas têm o mesmo tamanho e cobrem a imagem inteira: não precisa preencher o fundo
+                    big = Image.new('RGB', (img.width, img.height * len(self.patients)), None)
                 big.paste(img, (0,y))
                 y += img.height
+                del img
             fname = os.path.join(save_dir, 'pulseiras_todas.png')
-            big.save(fname, dpi=(DPI,DPI))
+            save_png(big, fname)
         messagebox.showinfo('Sucesso', f'Exportação PNG concluída em {save_dir}')
 
     def export_pdf(self):
@@ -695,82 +1198,79 @@ class PulseiraApp:
         # Pergunta se deseja salvar como um único PDF ou vários separados
         choice = messagebox.askquestion('Formato PDF', 'Deseja salvar cada pulseira como PDF separado? (Sim = separados, Não = único PDF)')
         try:
+            # ReportLab só é carregado ao exportar PDF: a janela abre mais rápido
+            from reportlab.pdfgen import canvas as pdfcanvas
             from reportlab.lib.utils import ImageReader
+
+            def draw_page(c, img):
+                # ImageReader aceita a PIL.Image diretamente (sem codificar/decodificar PNG por página);
+                # em RGB o ReportLab usa os bytes crus, sem conversão nem máscara de transparência.
+                # Não usamos JPEG aqui: seria mais rápido, mas borra o QR e as bordas do texto na impressão.
+                # drawInlineImage também foi descartado: mais lento e PDF bem maior (ASCII85, e não reaproveita
+                # páginas idênticas como o XObject do drawImage)
+                if img.mode != 'RGB':
+                    img = img.convert('RGB')
+                c.drawImage(ImageReader(img), 0, 0, width=PDF_PAGE_W_PT, height=PDF_PAGE_H_PT)
+                c.showPage()
+
+            fonts_arg = self._fonts_arg()
             if choice == 'yes':
                 # Vários arquivos separados
                 save_dir = filedialog.askdirectory()
                 if not save_dir:
                     return
-                for i, p in enumerate(self.patients):
-                    if self.font_reg_path:
-                        fonts_arg = (
-                            self.font_reg_path,
-                            self.font_bold_path,
-                            self.font_size,
-                            'auto' if self.auto_fit_enabled else 'no',
-                            self.name_font_size,
-                        )
-                    else:
-                        fonts_arg = (self.font_regular, self.font_bold)
-                    img = create_pulseira_image(p, logo_image=self.logo_image, fonts=fonts_arg)
-                    buf = io.BytesIO()
-                    img.save(buf, format='PNG', dpi=(DPI,DPI))
-                    buf.seek(0)
-                    pdf_path = os.path.join(save_dir, f"pulseira_{i+1}_{p.get('Número da carteirinha','')}.pdf")
-                    c = pdfcanvas.Canvas(pdf_path, pagesize=(P_WIDTH * 72.0 / DPI, P_HEIGHT * 72.0 / DPI))
-                    c.drawImage(ImageReader(buf), 0, 0, width=P_WIDTH * 72.0 / DPI, height=P_HEIGHT * 72.0 / DPI)
-                    c.showPage()
+                rendered = render_pulseiras(self.patients, logo_image=self.logo_resized, fonts=fonts_arg)
+                prefix = os.path.join(save_dir, 'pulseira_')
+                for i, (p, img) in enumerate(zip(self.patients, rendered)):
+                    pdf_path = f"{prefix}{i+1}_{p.get('Número da carteirinha','')}.pdf"
+                    c = pdfcanvas.Canvas(pdf_path, pagesize=PDF_PAGE_SIZE)
+                    draw_page(c, img)
                     c.save()
+                    del img
                 messagebox.showinfo('Sucesso', f'PDFs separados salvos em {save_dir}')
             else:
                 # Único arquivo PDF
                 save_path = filedialog.asksaveasfilename(defaultextension='.pdf', filetypes=[('PDF','*.pdf')], initialfile='pulseiras.pdf')
                 if not save_path:
                     return
-                c = pdfcanvas.Canvas(save_path, pagesize=(P_WIDTH * 72.0 / DPI, P_HEIGHT * 72.0 / DPI))
-                for p in self.patients:
-                    if self.font_reg_path:
-                        fonts_arg = (
-                            self.font_reg_path,
-                            self.font_bold_path,
-                            self.font_size,
-                            'auto' if self.auto_fit_enabled else 'no',
-                            self.name_font_size,
-                        )
-                    else:
-                        fonts_arg = (self.font_regular, self.font_bold)
-                    img = create_pulseira_image(p, logo_image=self.logo_image, fonts=fonts_arg)
-                    buf = io.BytesIO()
-                    img.save(buf, format='PNG', dpi=(DPI,DPI))
-                    buf.seek(0)
-                    c.drawImage(ImageReader(buf), 0, 0, width=P_WIDTH * 72.0 / DPI, height=P_HEIGHT * 72.0 / DPI)
-                    c.showPage()
+                c = pdfcanvas.Canvas(save_path, pagesize=PDF_PAGE_SIZE)
+                rendered = render_pulseiras(self.patients, logo_image=self.logo_resized, fonts=fonts_arg)
+                for img in rendered:
+                    draw_page(c, img)
+                    del img  # o ReportLab guarda só o stream comprimido
                 c.save()
                 messagebox.showinfo('Sucesso', f'PDF salvo em {save_path}')
         except Exception as e:
             messagebox.showerror('Erro', f'Falha ao gerar PDF: {e}')
 
+    def _font_path(self, family, bold, italic):
+        """choose_font_file_for_family memoizado: fonts_map não muda durante a sessão."""
+        key = (family, bool(bold), bool(italic))
+        if key not in self._font_path_cache:
+            self._font_path_cache[key] = choose_font_file_for_family(self.fonts_map, family, bold=bold, italic=italic)
+        return self._font_path_cache[key]
+
     def update_fonts(self):
         """Carrega as fontes PIL a partir da família/tamanho/estilo selecionados."""
         try:
-            reg_path = choose_font_file_for_family(self.fonts_map, self.font_family, bold=False, italic=self.font_italic_flag)
-            bold_path = choose_font_file_for_family(self.fonts_map, self.font_family, bold=self.font_bold_flag, italic=self.font_italic_flag)
+            reg_path = self._font_path(self.font_family, False, self.font_italic_flag)
+            bold_path = self._font_path(self.font_family, self.font_bold_flag, self.font_italic_flag)
             # armazena paths para uso em create_pulseira_image (auto-ajuste)
             self.font_reg_path = reg_path
             self.font_bold_path = bold_path or reg_path
             if reg_path:
-                self.font_regular = ImageFont.truetype(reg_path, size=self.font_size)
+                self.font_regular = _load_font(reg_path, self.font_size)
             else:
                 self.font_regular = ImageFont.load_default()
             if bold_path:
-                self.font_bold = ImageFont.truetype(bold_path, size=self.font_size)
+                self.font_bold = _load_font(bold_path, self.font_size)
             else:
                 # fallback para regular se não encontrou bold
                 self.font_bold = self.font_regular
             # Atualiza status com info da fonte
             self.status_var.set(f'Fonte: {self.font_family} {self.font_size}px (bold={self.font_bold_flag}, italic={self.font_italic_flag})')
-            print(f"[DEBUG] Font paths: Regular={self.font_reg_path}, Bold={self.font_bold_path}")
-            print(f"[DEBUG] Font size: {self.font_size}, Bold={self.font_bold_flag}, Italic={self.font_italic_flag}")
+            logger.debug("Font paths: Regular=%s, Bold=%s", self.font_reg_path, self.font_bold_path)
+            logger.debug("Font size: %s, Bold=%s, Italic=%s", self.font_size, self.font_bold_flag, self.font_italic_flag)
         except Exception:
             self.font_regular = ImageFont.load_default()
             self.font_bold = ImageFont.load_default()
@@ -815,7 +1315,11 @@ class PulseiraApp:
         cb_save = tb.Checkbutton(dlg, text='Salvar como padrão', variable=save_default_var)
         cb_save.grid(row=4, column=1, padx=6, pady=6, sticky='w')
 
-        def apply_and_close():
+        original = (self.font_family, self.font_size, self.name_font_size,
+                    self.font_bold_flag, self.font_italic_flag, self.auto_fit_enabled)
+        previewed = [False]
+
+        def read_settings():
             self.font_family = fam_cb.get() or self.font_family
             try:
                 self.font_size = int(size_sb.get())
@@ -828,6 +1332,27 @@ class PulseiraApp:
             self.font_bold_flag = bool(bold_var.get())
             self.font_italic_flag = bool(italic_var.get())
             self.auto_fit_enabled = bool(auto_fit_var.get())
+
+        def cancel_pending_preview():
+            if self._preview_after_id:
+                self.root.after_cancel(self._preview_after_id)
+                self._preview_after_id = None
+
+        def refresh_preview():
+            self._preview_after_id = None
+            previewed[0] = True
+            read_settings()
+            self.update_fonts()
+            self.update_preview()
+
+        def schedule_preview(_event=None):
+            # debounce: só a última alteração dentro de 150 ms renderiza a prévia
+            cancel_pending_preview()
+            self._preview_after_id = self.root.after(150, refresh_preview)
+
+        def apply_and_close():
+            cancel_pending_preview()
+            read_settings()
             self.update_fonts()
             self.update_preview()
             # salva como padrão, se marcado
@@ -838,10 +1363,28 @@ class PulseiraApp:
                 pass
             dlg.destroy()
 
+        def cancel():
+            cancel_pending_preview()
+            if previewed[0]:
+                # desfaz o que a prévia ao vivo aplicou
+                (self.font_family, self.font_size, self.name_font_size,
+                 self.font_bold_flag, self.font_italic_flag, self.auto_fit_enabled) = original
+                self.update_fonts()
+                self.update_preview()
+            dlg.destroy()
+
+        fam_cb.bind('<<ComboboxSelected>>', schedule_preview)
+        for sb in (size_sb, name_size_sb):
+            sb.configure(command=schedule_preview)
+            sb.bind('<KeyRelease>', schedule_preview)
+        for cb in (cb_bold, cb_italic, cb_auto):
+            cb.configure(command=schedule_preview)
+        dlg.protocol('WM_DELETE_WINDOW', cancel)
+
         btn_frame = tb.Frame(dlg)
         btn_frame.grid(row=6, column=0, columnspan=2, pady=8)
         tb.Button(btn_frame, text='Aplicar', command=apply_and_close).pack(side=LEFT, padx=6)
-        tb.Button(btn_frame, text='Cancelar', command=dlg.destroy).pack(side=LEFT, padx=6)
+        tb.Button(btn_frame, text='Cancelar', command=cancel).pack(side=LEFT, padx=6)
 
     def _load_prefs(self):
         try:
@@ -868,13 +1411,14 @@ class PulseiraApp:
                 'name_font_size': self.name_font_size,
                 'auto_fit_enabled': self.auto_fit_enabled,
             }
-            with open(self.prefs_file, 'w', encoding='utf-8') as f:
-                json.dump(data, f, ensure_ascii=False, indent=2)
+            write_json_atomic(self.prefs_file, data)
         except Exception:
             pass
 
 
 if __name__ == '__main__':
+    # executável congelado (PyInstaller) no Windows: os processos do pool reentram por aqui
+    multiprocessing.freeze_support()
     app = tb.Window(themename='flatly')
     PulseiraApp(app)
     app.mainloop()